@@ -4,10 +4,280 @@ Translates natural language questions into structured Pandas queries for clinica
 """
 
 import pandas as pd
+import numpy as np
+import asyncio
+import csv
+import hashlib
 import json
-from typing import Dict, List, Tuple
+import pickle
+import re
+import sys
+from typing import Dict, FrozenSet, List, Optional, Protocol, Set, Tuple, Union
 import os
 
+try:
+    from openai import AsyncOpenAI, OpenAI
+except ImportError:
+    AsyncOpenAI = OpenAI = None
+
+try:
+    from cyac import AC
+except ImportError:
+    AC = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "clinical_agent")
+DEFAULT_CACHE_PATH = os.path.join(DEFAULT_CACHE_DIR, "cache.pkl")
+DEFAULT_EXACT_CACHE_PATH = os.path.join(DEFAULT_CACHE_DIR, "exact_cache.json")
+
+# OpenAI chat model used to parse questions
+LLM_MODEL = "gpt-4"
+
+# Columns the LLM is allowed to filter on
+FILTERABLE_COLUMNS = ['AETERM', 'AESEV', 'AESOC', 'AEBODSYS', 'AESER', 'AEREL', 'AEOUT']
+
+# Keyword rules for the mock LLM, in precedence order:
+# (trigger keywords, target column, filter value or [(qualifier keyword, filter value), ...]).
+# A rule fires when any trigger keyword occurs in the question. Qualified rules return the
+# value of the first qualifier that also occurs (None always matches) and fall through otherwise.
+MockLLMRule = Tuple[List[str], str, Union[str, List[Tuple[Optional[str], str]]]]
+MOCK_LLM_RULES: List[MockLLMRule] = [
+    # Severity/Intensity mapping
+    (['severity', 'severe', 'intensity', 'intense'], 'AESEV',
+     [('mild', 'MILD'), ('moderate', 'MODERATE'), ('severe', 'SEVERE')]),
+
+    # Body system mapping
+    (['cardiac', 'heart', 'cardiovascular'], 'AESOC', 'CARDIAC DISORDERS'),
+    (['skin', 'dermal', 'dermatologic'], 'AESOC', 'SKIN AND SUBCUTANEOUS TISSUE DISORDERS'),
+    (['gastrointestinal', 'digestive', 'gi', 'stomach'], 'AESOC', 'GASTROINTESTINAL DISORDERS'),
+    (['infection', 'infectious'], 'AESOC', 'INFECTIONS AND INFESTATIONS'),
+    (['general disorder', 'administration site'], 'AESOC',
+     'GENERAL DISORDERS AND ADMINISTRATION SITE CONDITIONS'),
+
+    # Specific condition mapping (AETERM)
+    (['erythema'], 'AETERM', 'ERYTHEMA'),
+    (['diarrhea', 'diarrhoea'], 'AETERM', 'DIARRHOEA'),
+    (['fatigue'], 'AETERM', 'FATIGUE'),
+    (['pruritus', 'itching'], 'AETERM', 'APPLICATION SITE PRURITUS'),
+    (['headache'], 'AETERM', 'HEADACHE'),
+    (['nausea'], 'AETERM', 'NAUSEA'),
+    (['hiatus hernia'], 'AETERM', 'HIATUS HERNIA'),
+    (['bundle branch block'], 'AETERM', 'BUNDLE BRANCH BLOCK LEFT'),
+    (['respiratory infection'], 'AETERM', 'UPPER RESPIRATORY TRACT INFECTION'),
+
+    # Serious event mapping
+    (['serious'], 'AESER', 'Y'),
+
+    # Relationship mapping
+    (['relationship', 'related'], 'AEREL',
+     [('probable', 'PROBABLE'), ('possible', 'POSSIBLE'), ('remote', 'REMOTE'), ('none', 'NONE')]),
+
+    # Outcome mapping
+    (['outcome', 'resolved', 'recovered'], 'AEOUT',
+     [('not', 'NOT RECOVERED/NOT RESOLVED'), (None, 'RECOVERED/RESOLVED')]),
+]
+
+# Every keyword referenced by the rules, matched in a single Aho-Corasick pass when cyac is available
+MOCK_LLM_KEYWORDS: List[str] = sorted(
+    {kw for triggers, _, _ in MOCK_LLM_RULES for kw in triggers}
+    | {kw for _, _, value in MOCK_LLM_RULES if isinstance(value, list) for kw, _ in value if kw}
+)
+# Maximum number of questions whose query results are memoized per agent
+QUERY_CACHE_SIZE = 256
+
+# Rule-based parses at or above this confidence are used without calling the LLM
+RULE_CONFIDENCE_THRESHOLD = 0.8
+
+# Short or negatable keywords that are too ambiguous to skip the LLM on their own
+# (e.g. "gi" in "give", "not" in "noted", "serious" in "non-serious")
+AMBIGUOUS_KEYWORDS = frozenset({'gi', 'not', 'none', 'serious'})
+
+# Whole-word patterns per keyword; hyphens count as word characters so "non-serious" is one word
+_WHOLE_WORD_RES = {
+    kw: re.compile(r'(?<![\w-])' + re.escape(kw) + r'(?![\w-])') for kw in MOCK_LLM_KEYWORDS
+}
+
+_MOCK_LLM_AC = AC.build(MOCK_LLM_KEYWORDS) if AC is not None else None
+
+# Rules compiled once into (trigger set, column, value or qualifier tuple) for set-based evaluation
+CompiledMockLLMRule = Tuple[FrozenSet[str], str, Union[str, Tuple[Tuple[Optional[str], str], ...]]]
+_COMPILED_MOCK_LLM_RULES: List[CompiledMockLLMRule] = [
+    (frozenset(triggers), column, value if isinstance(value, str) else tuple(value))
+    for triggers, column, value in MOCK_LLM_RULES
+]
+
+
+def _is_valid_response(result: object) -> bool:
+    """Return True if a parsed LLM response names a filterable column and a string value."""
+    return (
+        isinstance(result, dict)
+        and result.get("target_column") in FILTERABLE_COLUMNS
+        and isinstance(result.get("filter_value"), str)
+    )
+
+
+def _match_keywords(question_lower: str) -> Set[str]:
+    """Return the rule keywords occurring as substrings of the normalized question."""
+    if _MOCK_LLM_AC is not None:
+        return {MOCK_LLM_KEYWORDS[kw_id] for kw_id, _, _ in _MOCK_LLM_AC.match(question_lower)}
+    return {kw for kw in MOCK_LLM_KEYWORDS if kw in question_lower}
+
+
+def _read_csv(data_path: str, category_columns: List[str]) -> pd.DataFrame:
+    """
+    Read the dataset, using pyarrow's multi-threaded CSV reader when it is installed.
+
+    Category columns are dictionary-encoded by Arrow and arrive as pandas categoricals.
+    SDTM date/time columns (*DTC) and any other column Arrow would infer as a date or
+    timestamp are read as text, and all-empty columns are cast to float64, matching
+    what pd.read_csv returns.
+
+    Args:
+        data_path: Path to the CSV file
+        category_columns: Columns to load with a category dtype
+
+    Returns:
+        The loaded DataFrame
+    """
+    if pa is None:
+        return pd.read_csv(data_path, dtype={col: 'category' for col in category_columns})
+
+    with open(data_path, newline='') as f:
+        header = next(csv.reader(f), [])
+    column_types = {col: pa.string() for col in header if col.endswith('DTC')}
+    column_types.update({col: pa.dictionary(pa.int32(), pa.string()) for col in category_columns})
+
+    def read(column_types: Dict[str, object]) -> 'pa.Table':
+        return pacsv.read_csv(
+            data_path,
+            read_options=pacsv.ReadOptions(use_threads=True),
+            convert_options=pacsv.ConvertOptions(column_types=column_types, strings_can_be_null=True),
+        )
+
+    table = read(column_types)
+    temporal = [field.name for field in table.schema if pa.types.is_temporal(field.type)]
+    if temporal:
+        # Re-read with the inferred date/time columns pinned, so their original text is kept
+        table = read({**column_types, **{col: pa.string() for col in temporal}})
+
+    schema = pa.schema([
+        field.with_type(pa.float64()) if pa.types.is_null(field.type) else field
+        for field in table.schema
+    ])
+    return table.cast(schema).to_pandas()
+
+
+class SemanticCache(Protocol):
+    """
+    Interface of the semantic response cache used by ClinicalTrialDataAgent.
+
+    Typing the agent against a protocol keeps the compiled (mypyc) module from rejecting
+    other implementations, such as the stand-in used by the test script.
+    """
+
+    def __len__(self) -> int: ...
+
+    def embed(self, question: str) -> np.ndarray: ...
+
+    def lookup(self, embedding: np.ndarray) -> Optional[Dict[str, str]]: ...
+
+    def add(self, embedding: np.ndarray, response: Dict[str, str]) -> None: ...
+
+
+class SemanticResponseCache:
+    """
+    Semantic cache of parsed LLM responses.
+
+    Questions are embedded with a small local sentence-transformer model and stored
+    in a FAISS inner-product index. Embeddings are normalized, so the inner product
+    is the cosine similarity. Entries are pickled to disk for warm starts across runs.
+    """
+
+    def __init__(self, cache_path: str = DEFAULT_CACHE_PATH, threshold: float = 0.92,
+                 model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+        """
+        Load the embedding model and any previously persisted cache entries.
+
+        Args:
+            cache_path: Path of the pickle file used to persist the cache
+            threshold: Minimum cosine similarity for a cached response to be reused
+            model_name: Name of the sentence-transformers embedding model
+        """
+        import faiss
+        from sentence_transformers import SentenceTransformer
+
+        self.cache_path = cache_path
+        self.threshold = threshold
+        self._model = SentenceTransformer(model_name)
+        self._index = faiss.IndexFlatIP(self._model.get_sentence_embedding_dimension())
+        self._responses: List[Dict[str, str]] = []
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def embed(self, question: str) -> np.ndarray:
+        """Return the normalized embedding of a question as a (1, dim) float32 array."""
+        embedding = self._model.encode([question.strip().casefold()], normalize_embeddings=True)
+        return np.asarray(embedding, dtype=np.float32)
+
+    def lookup(self, embedding: np.ndarray) -> Optional[Dict[str, str]]:
+        """Return the cached response closest to the embedding, if similar enough."""
+        if self._index.ntotal == 0:
+            return None
+
+        scores, ids = self._index.search(embedding, 1)
+        if scores[0][0] >= self.threshold:
+            return dict(self._responses[ids[0][0]])
+        return None
+
+    def add(self, embedding: np.ndarray, response: Dict[str, str]) -> None:
+        """Store a response under the given embedding and persist the cache."""
+        self._index.add(embedding)
+        self._responses.append(dict(response))
+        self._save()
+
+    def _load(self) -> None:
+        # A corrupt or foreign pickle can raise almost anything (TypeError, AttributeError,
+        # ImportError, ...) while loading or unpacking; treat it like a missing cache
+        try:
+            with open(self.cache_path, "rb") as f:
+                embeddings, responses = pickle.load(f)
+        except Exception:
+            return
+
+        if not (isinstance(embeddings, np.ndarray) and embeddings.ndim == 2
+                and embeddings.dtype == np.float32 and isinstance(responses, list)
+                and len(embeddings) == len(responses)
+                and all(_is_valid_response(response) for response in responses)):
+            return
+
+        if len(embeddings) and embeddings.shape[1] == self._index.d:
+            self._index.add(embeddings)
+            self._responses = list(responses)
+
+    def _save(self) -> None:
+        # The index already holds the embedding matrix, so nothing is restacked per add;
+        # write to a temporary file and rename it so a crash never leaves a partial pickle
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                pickle.dump((self._index.reconstruct_n(0, self._index.ntotal), self._responses), f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Could not persist LLM cache: {e}")
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
 
 class ClinicalTrialDataAgent:
     """
@@ -15,16 +285,80 @@ class ClinicalTrialDataAgent:
     and executes Pandas queries to return relevant subject information.
     """
 
-    def __init__(self, data_path: str, use_mock_llm: bool = False):
+    def __init__(self, data_path: str, use_mock_llm: bool = False, use_rules_first: bool = False,
+                 use_semantic_cache: bool = True, cache_path: str = DEFAULT_CACHE_PATH,
+                 exact_cache_path: Optional[str] = DEFAULT_EXACT_CACHE_PATH,
+                 parquet_path: Optional[str] = None):
         """
         Initialize the agent with the clinical trial data.
 
         Args:
             data_path: Path to the adae.csv file
             use_mock_llm: If True, use mock LLM responses instead of real API calls
+            use_rules_first: If True, only call the LLM when the rule-based parser is not confident
+                (an unambiguous whole-word rule match)
+            use_semantic_cache: If True, reuse LLM responses for semantically similar questions
+            cache_path: Path of the file used to persist the semantic LLM response cache
+            exact_cache_path: Path of the JSON file used to persist exact-match LLM responses
+                (None keeps the exact-match cache in memory only)
+            parquet_path: Optional Parquet copy of the data, (re)built from data_path when missing
+                or older than the CSV and memory-mapped on load (requires pyarrow)
         """
-        self.df = pd.read_csv(data_path)
+        # Repeated string columns are loaded as categoricals, so filters compare integer codes
+        if parquet_path and pa is not None:
+            if not os.path.exists(parquet_path) or os.path.getmtime(parquet_path) < os.path.getmtime(data_path):
+                self.prepare_cache(data_path, parquet_path)
+            self.df = pq.read_table(parquet_path, memory_map=True).to_pandas()
+        else:
+            self.df = _read_csv(data_path, FILTERABLE_COLUMNS + ['USUBJID'])
         self.use_mock_llm = use_mock_llm
+        self.use_rules_first = use_rules_first
+
+        # Inverted index: column -> uppercase value -> row positions (other columns are added on first use)
+        self._idx: Dict[str, Dict[str, np.ndarray]] = {
+            col: self._build_index(col) for col in FILTERABLE_COLUMNS if col in self.df.columns
+        }
+
+        # Memoized query() results: question -> (target_column, filter_value, results)
+        self._query_cache: Dict[str, Tuple[str, str, Tuple[int, List[str], pd.DataFrame]]] = {}
+
+        # Subject IDs as categorical codes, so unique subjects are found on integers
+        usubj_cat = self.df['USUBJID'].astype('category')
+        self._usubj_codes = usubj_cat.cat.codes.values
+        self._usubj_cats = usubj_cat.cat.categories
+
+        # Precomputed (count, subject_ids, row positions) for every indexed (column, uppercase value)
+        self._results: Dict[Tuple[str, str], Tuple[int, List[str], np.ndarray]] = {
+            (col, value): self._collect_subjects(idx)
+            for col, index in self._idx.items()
+            for value, idx in index.items()
+        }
+
+        # Exact-match and semantic caches of LLM responses (only relevant when calling the real API)
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_path = exact_cache_path
+        self._exact_cache: Dict[str, Dict[str, str]] = {}
+        if exact_cache_path and not use_mock_llm:
+            try:
+                with open(exact_cache_path) as f:
+                    loaded = json.load(f)
+            except (OSError, ValueError):
+                loaded = {}
+            if isinstance(loaded, dict):
+                self._exact_cache = {
+                    key: result for key, result in loaded.items() if _is_valid_response(result)
+                }
+
+        self._semantic_cache: Optional[SemanticCache] = None
+        if use_semantic_cache and not use_mock_llm:
+            try:
+                self._semantic_cache = SemanticResponseCache(cache_path)
+            except ImportError:
+                print("sentence-transformers/faiss not installed. Semantic cache disabled.")
+            except Exception as e:
+                # e.g. OSError when the embedding model cannot be downloaded offline
+                print(f"Could not load embedding model: {e}. Semantic cache disabled.")
 
         # Schema definition for the LLM to understand the dataset
         self.schema_definition = """
@@ -51,34 +385,93 @@ class ClinicalTrialDataAgent:
         - Questions about outcomes, resolution → Use AEOUT column
         """
 
-    def _call_llm(self, question: str) -> Dict[str, str]:
+        # Static system prompts, built once and sent as an unchanged prefix on every call
+        self._prompt_prefix = self._build_system_prompt()
+        self._batch_prompt_prefix = self._build_system_prompt(batch=True)
+
+    @staticmethod
+    def prepare_cache(csv_path: str, parquet_path: str) -> None:
         """
-        Call LLM to parse the question into structured output.
+        Convert the CSV dataset to a dictionary-encoded Parquet file.
+
+        Loading the Parquet file skips CSV parsing. The file is written to a temporary
+        path and renamed into place, so concurrent agents never read a partial file.
 
         Args:
-            question: Natural language question from user
+            csv_path: Path to the adae.csv file
+            parquet_path: Path of the Parquet file to write
 
-        Returns:
-            Dictionary with 'target_column' and 'filter_value'
+        Raises:
+            ImportError: If pyarrow is not installed
         """
-        if self.use_mock_llm:
-            return self._mock_llm_response(question)
+        if pa is None:
+            raise ImportError("pyarrow is required to write the Parquet cache")
 
-        # Real LLM implementation using OpenAI
+        df = _read_csv(csv_path, FILTERABLE_COLUMNS + ['USUBJID'])
+        os.makedirs(os.path.dirname(parquet_path) or ".", exist_ok=True)
+        tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
         try:
-            from openai import OpenAI
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path, use_dictionary=True)
+            os.replace(tmp_path, parquet_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
-            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def _build_index(self, column: str) -> Dict[str, np.ndarray]:
+        """
+        Map each uppercase value of a column to the positions of the rows holding it.
+
+        The uppercase conversion runs once per category instead of once per row and query.
+
+        Args:
+            column: Column of self.df to index
+
+        Returns:
+            Dictionary of uppercase value -> sorted row positions
+        """
+        values = self.df[column]
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype('category')
+
+        # Group rows by uppercase value in one pass: a stable sort of the group ids
+        # keeps the row positions ascending within each group
+        codes = values.cat.codes.values
+        cat_groups, upper_values = pd.factorize(values.cat.categories.astype(str).str.upper())
+        rows = np.flatnonzero(codes >= 0)
+        groups = cat_groups[codes[rows]]
+        order = np.argsort(groups, kind='stable')
+        bounds = np.cumsum(np.bincount(groups, minlength=len(upper_values)))[:-1]
+        return dict(zip(upper_values, np.split(rows[order], bounds)))
+
+    def _build_system_prompt(self, batch: bool = False) -> str:
+        """
+        Build the system message for the LLM.
+
+        The schema and instructions come first so repeated calls share a cacheable prompt prefix.
+
+        Args:
+            batch: If True, ask for a JSON array with one object per numbered question
 
-            prompt = f"""
+        Returns:
+            System message content
+        """
+        if batch:
+            task = ("Parse each of the user's numbered questions and return ONLY a JSON array "
+                    "with one object per question, in the same order. Each object has two fields:")
+            example = '[{"target_column": "AESEV", "filter_value": "MODERATE"}]'
+        else:
+            task = "Parse the user's question and return ONLY a JSON object with two fields:"
+            example = '{"target_column": "AESEV", "filter_value": "MODERATE"}'
+
+        return f"""
 {self.schema_definition}
 
-Task: Parse the following question and return ONLY a JSON object with two fields:
+You are a clinical data parsing assistant.
+
+Task: {task}
 1. "target_column": The column name to filter on (must be exactly one of: AETERM, AESEV, AESOC, AEBODSYS, AESER, AEREL, AEOUT)
 2. "filter_value": The exact value to search for (use uppercase for consistency)
 
-Question: {question}
-
 Important:
 - For severity questions: AESEV can be "MILD", "MODERATE", or "SEVERE"
 - For condition/event names: Use AETERM and extract the medical term
@@ -86,27 +479,266 @@ Important:
 - Return ONLY valid JSON, no additional text
 
 Example response format:
-{{"target_column": "AESEV", "filter_value": "MODERATE"}}
+{example}
 """
 
+    def _resolve_locally(self, question: str) -> Optional[Dict[str, str]]:
+        """
+        Parse a question without the LLM when possible.
+
+        Args:
+            question: Natural language question from user
+
+        Returns:
+            The mock response in mock mode, the rule-based parse when it is confident
+            and rules-first mode is enabled, otherwise None
+        """
+        if self.use_mock_llm:
+            return self._mock_llm_response(question)
+
+        if self.use_rules_first:
+            result, confidence = self._rule_based_parse(question)
+            if confidence >= RULE_CONFIDENCE_THRESHOLD:
+                return result
+        return None
+
+    def _lookup_cache(self, question: str) -> Tuple[str, Optional[np.ndarray], Optional[Dict[str, str]]]:
+        """
+        Look a question up in the exact-match cache, then the semantic cache.
+
+        Args:
+            question: Natural language question from user
+
+        Returns:
+            Tuple of the exact-match key, the question embedding (None if the semantic
+            cache was not consulted) and the cached response (None on a miss)
+        """
+        key = hashlib.sha256(question.strip().casefold().encode()).hexdigest()
+        if key in self._exact_cache:
+            self._cache_hits += 1
+            return key, None, dict(self._exact_cache[key])
+
+        embedding = None
+        if self._semantic_cache is not None:
+            embedding = self._semantic_cache.embed(question)
+            cached = self._semantic_cache.lookup(embedding)
+            if cached is not None:
+                self._cache_hits += 1
+                self._store_exact(key, cached)
+                return key, embedding, cached
+        self._cache_misses += 1
+        return key, embedding, None
+
+    def _store_response(self, key: str, embedding: Optional[np.ndarray], result: Dict[str, str]) -> None:
+        """Store a fresh, validated LLM response in the exact-match and semantic caches."""
+        self._store_exact(key, result)
+        if self._semantic_cache is not None and embedding is not None:
+            self._semantic_cache.add(embedding, result)
+
+    def _llm_messages(self, question: str) -> List[Dict[str, str]]:
+        """Build the chat messages asking the LLM to parse a single question."""
+        return [
+            {"role": "system", "content": self._prompt_prefix},
+            {"role": "user", "content": f"Question: {question}"}
+        ]
+
+    def _handle_llm_response(self, content: str, key: str, embedding: Optional[np.ndarray]) -> Dict[str, str]:
+        """
+        Parse, validate and cache the reply to a single-question LLM call.
+
+        Args:
+            content: Message content returned by the LLM
+            key: Exact-match cache key of the question
+            embedding: Question embedding for the semantic cache, if consulted
+
+        Returns:
+            Dictionary with 'target_column' and 'filter_value'
+
+        Raises:
+            ValueError: If the reply is not valid JSON or not a valid response
+        """
+        result = json.loads(content)
+        if not _is_valid_response(result):
+            raise ValueError(f"invalid LLM response {result!r}")
+        self._store_response(key, embedding, result)
+        return result
+
+    def _call_llm(self, question: str) -> Dict[str, str]:
+        """
+        Call LLM to parse the question into structured output.
+
+        Args:
+            question: Natural language question from user
+
+        Returns:
+            Dictionary with 'target_column' and 'filter_value'
+        """
+        return self._parse_question(question)[0]
+
+    def _parse_question(self, question: str) -> Tuple[Dict[str, str], bool]:
+        """
+        Parse a question like _call_llm, reporting whether the LLM fallback was used.
+
+        Args:
+            question: Natural language question from user
+
+        Returns:
+            Tuple of the dictionary with 'target_column' and 'filter_value', and True if
+            the mock parser answered because the LLM was unavailable or failed
+        """
+        local = self._resolve_locally(question)
+        if local is not None:
+            return local, False
+
+        key, embedding, cached = self._lookup_cache(question)
+        if cached is not None:
+            return cached, False
+
+        if OpenAI is None:
+            print("OpenAI library not installed. Using mock LLM.")
+            return self._mock_llm_response(question), True
+
+        # Real LLM implementation using OpenAI
+        try:
+            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
             response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a clinical data parsing assistant. Return only valid JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0
+                model=LLM_MODEL, messages=self._llm_messages(question), temperature=0
             )
+            return self._handle_llm_response(response.choices[0].message.content, key, embedding), False
 
-            result = json.loads(response.choices[0].message.content)
-            return result
+        except Exception as e:
+            print(f"Error calling LLM: {e}. Using mock response.")
+            return self._mock_llm_response(question), True
+
+    async def _call_llm_async(self, question: str,
+                              client: Optional["AsyncOpenAI"]) -> Tuple[Dict[str, str], bool]:
+        """
+        Asynchronous variant of _parse_question, so independent questions can be parsed concurrently.
+
+        Args:
+            question: Natural language question from user
+            client: Shared AsyncOpenAI client, None if the LLM is unavailable
+
+        Returns:
+            Tuple of the dictionary with 'target_column' and 'filter_value', and True if
+            the mock parser answered because the LLM was unavailable or failed
+        """
+        local = self._resolve_locally(question)
+        if local is not None:
+            return local, False
+
+        key, embedding, cached = self._lookup_cache(question)
+        if cached is not None:
+            return cached, False
+
+        if client is None:
+            return self._mock_llm_response(question), True
+
+        try:
+            response = await client.chat.completions.create(
+                model=LLM_MODEL, messages=self._llm_messages(question), temperature=0
+            )
+            return self._handle_llm_response(response.choices[0].message.content, key, embedding), False
 
-        except ImportError:
-            print("OpenAI library not installed. Using mock LLM.")
-            return self._mock_llm_response(question)
         except Exception as e:
             print(f"Error calling LLM: {e}. Using mock response.")
-            return self._mock_llm_response(question)
+            return self._mock_llm_response(question), True
+
+    def _call_llm_batch(self, questions: List[str]) -> List[Dict[str, str]]:
+        """
+        Parse several questions with a single LLM request.
+
+        Cached questions are answered from the caches; the remaining ones are sent together
+        so the schema prefix and network round-trip are paid once. Fresh responses are cached,
+        so subsequent query() calls for the same questions do not call the API again.
+
+        Args:
+            questions: Natural language questions from user
+
+        Returns:
+            List of dictionaries with 'target_column' and 'filter_value', one per question
+        """
+        # Unresolved questions by exact-match key, so duplicates are only sent once
+        results: List[Optional[Dict[str, str]]] = []
+        pending: Dict[str, Tuple[str, Optional[np.ndarray], List[int]]] = {}
+        for i, question in enumerate(questions):
+            local = self._resolve_locally(question)
+            if local is not None:
+                results.append(local)
+                continue
+
+            key, embedding, cached = self._lookup_cache(question)
+            results.append(cached)
+            if cached is None:
+                pending.setdefault(key, (question, embedding, []))[2].append(i)
+
+        if pending and OpenAI is None:
+            print("OpenAI library not installed. Using mock LLM.")
+        elif pending:
+            try:
+                client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+                numbered = "\n".join(
+                    f"{n}. {question}" for n, (question, _, _) in enumerate(pending.values(), 1)
+                )
+                response = client.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=[
+                        {"role": "system", "content": self._batch_prompt_prefix},
+                        {"role": "user", "content": f"Questions:\n{numbered}"}
+                    ],
+                    temperature=0
+                )
+
+                parsed = json.loads(response.choices[0].message.content)
+                if not isinstance(parsed, list) or len(parsed) != len(pending):
+                    raise ValueError(f"expected a JSON array of {len(pending)} objects")
+
+                for (key, (_, embedding, indices)), result in zip(pending.items(), parsed):
+                    if not _is_valid_response(result):
+                        print(f"Invalid LLM response {result!r}. Using mock response.")
+                        continue
+                    self._store_response(key, embedding, result)
+                    for i in indices:
+                        results[i] = result
+
+            except Exception as e:
+                print(f"Error calling LLM: {e}. Using mock response.")
+
+        return [
+            result if result is not None else self._mock_llm_response(question)
+            for question, result in zip(questions, results)
+        ]
+
+    def _store_exact(self, key: str, result: Dict[str, str]) -> None:
+        """Store a validated response in the exact-match cache and persist it."""
+        self._exact_cache[key] = dict(result)
+        if not self._cache_path:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self._cache_path) or ".", exist_ok=True)
+            with open(self._cache_path, "w") as f:
+                json.dump(self._exact_cache, f)
+        except OSError as e:
+            print(f"Could not persist LLM cache: {e}")
+
+    def cache_stats(self) -> Dict[str, float]:
+        """
+        Report LLM response cache statistics.
+
+        Returns:
+            Dictionary with hits, misses, hit_rate and number of exact/semantic cache entries
+        """
+        lookups = self._cache_hits + self._cache_misses
+        return {
+            "hits": self._cache_hits,
+            "misses": self._cache_misses,
+            "hit_rate": self._cache_hits / lookups if lookups else 0.0,
+            "exact_entries": len(self._exact_cache),
+            "semantic_entries": len(self._semantic_cache) if self._semantic_cache is not None else 0,
+        }
 
     def _mock_llm_response(self, question: str) -> Dict[str, str]:
         """
@@ -119,73 +751,40 @@ Example response format:
         Returns:
             Dictionary with 'target_column' and 'filter_value'
         """
-        question_lower = question.lower()
-
-        # Severity/Intensity mapping
-        if any(word in question_lower for word in ['severity', 'severe', 'intensity', 'intense']):
-            if 'mild' in question_lower:
-                return {"target_column": "AESEV", "filter_value": "MILD"}
-            elif 'moderate' in question_lower:
-                return {"target_column": "AESEV", "filter_value": "MODERATE"}
-            elif 'severe' in question_lower:
-                return {"target_column": "AESEV", "filter_value": "SEVERE"}
-
-        # Body system mapping
-        if any(word in question_lower for word in ['cardiac', 'heart', 'cardiovascular']):
-            return {"target_column": "AESOC", "filter_value": "CARDIAC DISORDERS"}
-        elif any(word in question_lower for word in ['skin', 'dermal', 'dermatologic']):
-            return {"target_column": "AESOC", "filter_value": "SKIN AND SUBCUTANEOUS TISSUE DISORDERS"}
-        elif any(word in question_lower for word in ['gastrointestinal', 'digestive', 'gi', 'stomach']):
-            return {"target_column": "AESOC", "filter_value": "GASTROINTESTINAL DISORDERS"}
-        elif any(word in question_lower for word in ['infection', 'infectious']):
-            return {"target_column": "AESOC", "filter_value": "INFECTIONS AND INFESTATIONS"}
-        elif any(word in question_lower for word in ['general disorder', 'administration site']):
-            return {"target_column": "AESOC", "filter_value": "GENERAL DISORDERS AND ADMINISTRATION SITE CONDITIONS"}
-
-        # Specific condition mapping (AETERM)
-        conditions = {
-            'erythema': 'ERYTHEMA',
-            'diarrhea': 'DIARRHOEA',
-            'diarrhoea': 'DIARRHOEA',
-            'fatigue': 'FATIGUE',
-            'pruritus': 'APPLICATION SITE PRURITUS',
-            'itching': 'APPLICATION SITE PRURITUS',
-            'headache': 'HEADACHE',
-            'nausea': 'NAUSEA',
-            'hiatus hernia': 'HIATUS HERNIA',
-            'bundle branch block': 'BUNDLE BRANCH BLOCK LEFT',
-            'respiratory infection': 'UPPER RESPIRATORY TRACT INFECTION',
-        }
+        return self._rule_based_parse(question)[0]
 
-        for condition_key, condition_value in conditions.items():
-            if condition_key in question_lower:
-                return {"target_column": "AETERM", "filter_value": condition_value}
-
-        # Serious event mapping
-        if 'serious' in question_lower:
-            value = 'Y' if 'yes' in question_lower or 'serious' in question_lower else 'N'
-            return {"target_column": "AESER", "filter_value": value}
-
-        # Relationship mapping
-        if 'relationship' in question_lower or 'related' in question_lower:
-            if 'probable' in question_lower:
-                return {"target_column": "AEREL", "filter_value": "PROBABLE"}
-            elif 'possible' in question_lower:
-                return {"target_column": "AEREL", "filter_value": "POSSIBLE"}
-            elif 'remote' in question_lower:
-                return {"target_column": "AEREL", "filter_value": "REMOTE"}
-            elif 'none' in question_lower:
-                return {"target_column": "AEREL", "filter_value": "NONE"}
-
-        # Outcome mapping
-        if 'outcome' in question_lower or 'resolved' in question_lower or 'recovered' in question_lower:
-            if 'not' in question_lower:
-                return {"target_column": "AEOUT", "filter_value": "NOT RECOVERED/NOT RESOLVED"}
-            else:
-                return {"target_column": "AEOUT", "filter_value": "RECOVERED/RESOLVED"}
+    def _rule_based_parse(self, question: str) -> Tuple[Dict[str, str], float]:
+        """
+        Parse a question with the keyword rules in MOCK_LLM_RULES.
+
+        Args:
+            question: Natural language question
+
+        Returns:
+            Tuple of the dictionary with 'target_column' and 'filter_value', and the
+            confidence: 1.0 when the rule fired on unambiguous whole words, 0.5 when it
+            only fired on substrings or ambiguous keywords, 0.0 for the default fallback
+        """
+        question_lower = question.strip().casefold()
+        hits = _match_keywords(question_lower)
+
+        def is_confident(kw: str) -> bool:
+            return kw not in AMBIGUOUS_KEYWORDS and _WHOLE_WORD_RES[kw].search(question_lower) is not None
+
+        for triggers, column, value in _COMPILED_MOCK_LLM_RULES:
+            if triggers.isdisjoint(hits):
+                continue
+            confident = any(is_confident(kw) for kw in triggers & hits)
+            if isinstance(value, str):
+                return {"target_column": column, "filter_value": value}, 1.0 if confident else 0.5
+            for qualifier, qualified_value in value:
+                if qualifier is None or qualifier in hits:
+                    if qualifier is not None:
+                        confident = confident and is_confident(qualifier)
+                    return {"target_column": column, "filter_value": qualified_value}, 1.0 if confident else 0.5
 
         # Default fallback
-        return {"target_column": "AESEV", "filter_value": "MILD"}
+        return {"target_column": "AESEV", "filter_value": "MILD"}, 0.0
 
     def query(self, question: str) -> Tuple[int, List[str], pd.DataFrame]:
         """
@@ -199,27 +798,120 @@ Example response format:
                 - count: Number of unique subjects matching the criteria
                 - subject_ids: List of unique subject IDs
                 - filtered_df: DataFrame with all matching records
+
+            Results are memoized per question, so repeated calls share the same
+            subject list and DataFrame; treat them as read-only. Answers from the
+            mock fallback used when the LLM call fails are not memoized.
         """
-        # Parse question using LLM
-        llm_output = self._call_llm(question)
+        fallback = False
+        if question in self._query_cache:
+            target_column, filter_value, results = self._query_cache[question]
+        else:
+            # Parse question using LLM
+            llm_output, fallback = self._parse_question(question)
 
-        target_column = llm_output['target_column']
-        filter_value = llm_output['filter_value']
+            target_column = llm_output['target_column']
+            filter_value = llm_output['filter_value']
+            results = None
 
         print(f"\nParsed Query:")
         print(f"   Column: {target_column}")
         print(f"   Value: {filter_value}")
 
-        # Execute Pandas filter
-        filtered_df = self.df[
-            self.df[target_column].str.upper() == filter_value.upper()
-        ].copy()
+        if results is None:
+            results = self._execute_filter(target_column, filter_value)
+            # Fallback answers are not memoized, so the LLM is retried on the next call
+            if not fallback:
+                self._remember_query(question, target_column, filter_value, results)
+
+        return results
 
-        # Extract unique subjects
-        unique_subjects = filtered_df['USUBJID'].unique().tolist()
-        count = len(unique_subjects)
+    async def query_many(self, questions: List[str]) -> List[Tuple[int, List[str], pd.DataFrame]]:
+        """
+        Process several questions, parsing the uncached ones with concurrent LLM calls.
+
+        Args:
+            questions: Natural language questions about the data
+
+        Returns:
+            List of (count, subject_ids, filtered_df) tuples, one per question
+
+            Results are memoized like query(), so display_results() and query() reuse them.
+        """
+        results = {q: self._query_cache[q][2] for q in questions if q in self._query_cache}
+        pending = [q for q in dict.fromkeys(questions) if q not in results]
+
+        # One client (and connection pool) shared by all concurrent calls
+        client = None
+        if pending and not self.use_mock_llm:
+            if AsyncOpenAI is None:
+                print("OpenAI library not installed. Using mock LLM.")
+            else:
+                try:
+                    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+                except Exception as e:
+                    print(f"Error creating LLM client: {e}. Using mock response.")
+
+        try:
+            llm_outputs = await asyncio.gather(*[self._call_llm_async(q, client) for q in pending])
+        finally:
+            if client is not None:
+                await client.close()
+
+        for question, (llm_output, fallback) in zip(pending, llm_outputs):
+            target_column = llm_output['target_column']
+            filter_value = llm_output['filter_value']
+            results[question] = self._execute_filter(target_column, filter_value)
+            # Fallback answers are not memoized, so the LLM is retried on the next call
+            if not fallback:
+                self._remember_query(question, target_column, filter_value, results[question])
+
+        return [results[q] for q in questions]
+
+    def _remember_query(self, question: str, target_column: str, filter_value: str,
+                        results: Tuple[int, List[str], pd.DataFrame]) -> None:
+        """Memoize the results of a question, evicting the oldest entry when the cache is full."""
+        if len(self._query_cache) >= QUERY_CACHE_SIZE:
+            self._query_cache.pop(next(iter(self._query_cache)))
+        self._query_cache[question] = (target_column, filter_value, results)
+
+    def _execute_filter(self, target_column: str, filter_value: str) -> Tuple[int, List[str], pd.DataFrame]:
+        """
+        Filter the data on a column value and collect the matching subjects.
 
-        return count, unique_subjects, filtered_df
+        Args:
+            target_column: Column to filter on
+            filter_value: Value to match (case-insensitive)
+
+        Returns:
+            Tuple of (count, subject_ids, filtered_df) as returned by query()
+        """
+        key = (target_column, filter_value.upper())
+        if key not in self._results:
+            if target_column not in self._idx:
+                self._idx[target_column] = self._build_index(target_column)
+            if key[1] not in self._idx[target_column]:
+                return 0, [], self.df.iloc[:0]
+            self._results[key] = self._collect_subjects(self._idx[target_column][key[1]])
+
+        count, unique_subjects, idx = self._results[key]
+        return count, list(unique_subjects), self.df.iloc[idx]
+
+    def _collect_subjects(self, idx: np.ndarray) -> Tuple[int, List[str], np.ndarray]:
+        """
+        Collect the unique subjects of a set of rows.
+
+        Args:
+            idx: Sorted row positions
+
+        Returns:
+            Tuple of (count, subject_ids in order of first appearance, idx)
+        """
+        codes, first = np.unique(self._usubj_codes[idx], return_index=True)
+        codes = codes[np.argsort(first)]
+        unique_subjects = self._usubj_cats.take(codes[codes >= 0]).tolist()
+
+        return len(unique_subjects), unique_subjects, idx
 
     def display_results(self, question: str) -> None:
         """
@@ -228,24 +920,25 @@ Example response format:
         Args:
             question: Natural language question about the data
         """
-        print(f"\n{'='*80}")
-        print(f"Question: {question}")
-        print(f"{'='*80}")
+        # Output is assembled into one string per block and written with a single call
+        sys.stdout.write(f"\n{'='*80}\nQuestion: {question}\n{'='*80}\n")
 
         count, subject_ids, filtered_df = self.query(question)
 
-        print(f"\nResults:")
-        print(f"   Total matching records: {len(filtered_df)}")
-        print(f"   Unique subjects: {count}")
-        print(f"\n👥 Subject IDs:")
-        for idx, subject_id in enumerate(subject_ids, 1):
-            print(f"   {idx}. {subject_id}")
+        parts = [
+            f"\nResults:",
+            f"   Total matching records: {len(filtered_df)}",
+            f"   Unique subjects: {count}",
+            f"\n👥 Subject IDs:",
+        ]
+        parts.extend(f"   {idx}. {subject_id}" for idx, subject_id in enumerate(subject_ids, 1))
 
         if len(filtered_df) > 0:
-            print(f"\nSample Records (first 5):")
-            print(filtered_df[['USUBJID', 'AETERM', 'AESEV', 'AESOC']].head().to_string(index=False))
+            parts.append(f"\nSample Records (first 5):")
+            parts.append(filtered_df.head()[['USUBJID', 'AETERM', 'AESEV', 'AESOC']].to_string(index=False))
 
-        print(f"\n{'='*80}\n")
+        parts.append(f"\n{'='*80}\n")
+        sys.stdout.write("\n".join(parts) + "\n")
 
 
 def main():
@@ -269,6 +962,9 @@ def main():
         "Show me patients with erythema"
     ]
 
+    # Parse and filter all questions concurrently; display_results then reuses the memoized results
+    asyncio.run(agent.query_many(test_questions))
+
     for question in test_questions:
         agent.display_results(question)
 
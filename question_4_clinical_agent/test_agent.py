@@ -3,8 +3,14 @@ Simple test script for the Clinical Trial Data Agent
 Runs example queries and validates results
 """
 
+from question_4_clinical_agent import clinical_data_agent
 from question_4_clinical_agent.clinical_data_agent import ClinicalTrialDataAgent
+from types import SimpleNamespace
+import asyncio
+import json
+import os
 import sys
+import tempfile
 
 
 def run_basic_tests():
@@ -111,10 +117,188 @@ def run_advanced_tests():
         agent.display_results(question)
 
 
+class _StubSemanticCache:
+    """Semantic cache stand-in that treats questions differing only in punctuation as similar."""
+
+    def __init__(self):
+        self._responses = {}
+
+    def __len__(self):
+        return len(self._responses)
+
+    def embed(self, question):
+        return question.strip().casefold().rstrip("?!.")
+
+    def lookup(self, embedding):
+        return self._responses.get(embedding)
+
+    def add(self, embedding, response):
+        self._responses[embedding] = dict(response)
+
+
+def _stub_openai(reply, calls, is_async):
+    """Build a stand-in for the OpenAI/AsyncOpenAI client classes answering with reply(messages)."""
+
+    async def completed(response):
+        return response
+
+    def create(model, messages, temperature):
+        calls.append(messages)
+        message = SimpleNamespace(content=reply(messages))
+        response = SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        return completed(response) if is_async else response
+
+    def client(api_key=None):
+        state = SimpleNamespace(closed=False)
+
+        async def close():
+            state.closed = True
+
+        clients.append(state)
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)), close=close)
+
+    clients = []
+    client.clients = clients
+    return client
+
+
+def run_llm_path_tests():
+    """Exercise the OpenAI code paths and caches against a stubbed client (no API key needed)."""
+
+    print("\n" + "=" * 90)
+    print("LLM PATH TEST SUITE (stubbed OpenAI client)")
+    print("=" * 90)
+
+    # The stub answers like the rule-based parser, except for questions asking for an invalid
+    # reply and questions in `unavailable`, for which the request times out
+    oracle = ClinicalTrialDataAgent(data_path="adae.csv", use_mock_llm=True)
+    unavailable = set()
+
+    def reply(messages):
+        content = messages[-1]["content"]
+        if content.startswith("Questions:\n"):
+            questions = [line.split(". ", 1)[1] for line in content.splitlines()[1:]]
+            return json.dumps([oracle._mock_llm_response(q) for q in questions])
+        question = content[len("Question: "):]
+        if question in unavailable:
+            raise TimeoutError("Request timed out")
+        if "invalid" in question:
+            return json.dumps({"target_column": "USUBJID", "filter_value": "01-701-1015"})
+        return json.dumps(oracle._mock_llm_response(question))
+
+    calls = []
+    original = clinical_data_agent.OpenAI, clinical_data_agent.AsyncOpenAI
+    clinical_data_agent.OpenAI = _stub_openai(reply, calls, is_async=False)
+    clinical_data_agent.AsyncOpenAI = _stub_openai(reply, calls, is_async=True)
+
+    checks = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            exact_cache_path = os.path.join(tmp, "exact_cache.json")
+
+            def make_agent(**kwargs):
+                return ClinicalTrialDataAgent(data_path="adae.csv", use_semantic_cache=False,
+                                              exact_cache_path=exact_cache_path, **kwargs)
+
+            agent = make_agent()
+            questions = [
+                "Give me the subjects who had Adverse events of Moderate severity",
+                "Which subjects experienced cardiac disorders?",
+                "Show me patients with erythema",
+            ]
+
+            # Batch: one request for all questions, duplicates sent once
+            parsed = agent._call_llm_batch(questions + questions[:1])
+            checks.append(("batch parses all questions with one request",
+                           len(calls) == 1 and parsed == [oracle._mock_llm_response(q) for q in questions + questions[:1]]))
+
+            # Exact-match cache: batch responses are reused in memory and across agents
+            for question in questions:
+                agent.query(question)
+            fresh = make_agent()
+            fresh._call_llm(questions[0].upper() + "  ")
+            checks.append(("exact cache reused in memory and from disk", len(calls) == 1))
+
+            # Invalid responses fall back to the mock parser and are not cached
+            invalid = "Give me an invalid answer about nausea"
+            first = agent._call_llm(invalid)
+            agent._call_llm(invalid)
+            checks.append(("invalid response falls back to mock and is not cached",
+                           len(calls) == 3 and first == oracle._mock_llm_response(invalid)))
+
+            # Semantic cache: a near-duplicate question is answered without the LLM
+            agent._semantic_cache = _StubSemanticCache()
+            agent._call_llm("List patients with fatigue")
+            agent._call_llm("list patients with fatigue?!")
+            checks.append(("semantic cache answers near-duplicate question",
+                           len(calls) == 4 and agent.cache_stats()["semantic_entries"] == 1))
+            agent._semantic_cache = None
+
+            # Async: query_many parses concurrently with one shared client and memoizes the results
+            advanced_queries = ["Who had mild severity events?", "Show me skin disorders"]
+            results = asyncio.run(agent.query_many(advanced_queries))
+            memoized = all(agent.query(q)[1] is result[1] for q, result in zip(advanced_queries, results))
+            async_clients = clinical_data_agent.AsyncOpenAI.clients
+            checks.append(("query_many calls the async client and memoizes results",
+                           len(calls) == 6 and memoized))
+            checks.append(("query_many shares and closes one async client",
+                           len(async_clients) == 1 and async_clients[0].closed))
+
+            # Rules-first: confident whole-word matches skip the LLM, ambiguous ones do not
+            rules_first = make_agent(use_rules_first=True)
+            rules_first._call_llm("Show me patients with headache or erythema today")
+            skipped = len(calls) == 6
+            rules_first._call_llm("Give me patients with headache")
+            checks.append(("rules-first skips the LLM only for confident matches",
+                           skipped and len(calls) == 7))
+
+            # Fallback answers after a failed call are not memoized, so query() retries the LLM
+            flaky = "Which subjects had nausea?"
+            unavailable.add(flaky)
+            agent.query(flaky)
+            unavailable.clear()
+            agent.query(flaky)
+            agent.query(flaky)
+            checks.append(("query retries the LLM after a failed call", len(calls) == 9))
+
+            # Same for query_many: the failed question is parsed again on the next call
+            flaky = "Which subjects had vomiting?"
+            unavailable.add(flaky)
+            asyncio.run(agent.query_many([flaky]))
+            unavailable.clear()
+            asyncio.run(agent.query_many([flaky]))
+            agent.query(flaky)
+            checks.append(("query_many retries the LLM after a failed call", len(calls) == 11))
+
+            # Parquet: the cached copy gives the same results as the CSV
+            if clinical_data_agent.pa is not None:
+                parquet_path = os.path.join(tmp, "adae.parquet")
+                from_parquet = ClinicalTrialDataAgent(data_path="adae.csv", use_mock_llm=True,
+                                                      parquet_path=parquet_path)
+                same = all(from_parquet.query(q)[:2] == oracle.query(q)[:2] for q in questions)
+                checks.append(("Parquet cache matches CSV results", os.path.exists(parquet_path) and same))
+            else:
+                print("\npyarrow not installed. Skipping Parquet check.")
+    finally:
+        clinical_data_agent.OpenAI, clinical_data_agent.AsyncOpenAI = original
+
+    print("\n" + "=" * 90)
+    print("LLM PATH TEST SUMMARY")
+    print("=" * 90)
+    for name, passed in checks:
+        print(f"  {'PASS' if passed else 'FAIL'}: {name}")
+    print()
+
+    return all(passed for _, passed in checks)
+
+
 if __name__ == "__main__":
     # Run basic tests
     success = run_basic_tests()
 
+    # Exercise the OpenAI code paths with a stubbed client
+    success = run_llm_path_tests() and success
+
     # Optionally run advanced tests
     if "--advanced" in sys.argv or "-a" in sys.argv:
         run_advanced_tests()